@@ -1,63 +1,98 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from core.modelo import ModeloAnomalias
+from core.hst import ModeloHalfSpaceTrees
 from core.gestor import GestorSensores
 from schemas import SistemaDTO, EstadoSensorDTO, LecturaSensorDTO
 import asyncio
 import json
-from typing import List
+import os
+import orjson
+from typing import Dict, List
 from datetime import datetime
 
 
 app = FastAPI()
 
 # Inicializar el sistema existente
-modelo = ModeloAnomalias()
+# MODELO_ANOMALIAS=hst usa Half-Space Trees en línea en lugar del IsolationForest entrenado
+modelo = ModeloHalfSpaceTrees() if os.getenv("MODELO_ANOMALIAS") == "hst" else ModeloAnomalias()
 gestor = GestorSensores(modelo)
 
-# Configurar sensores (esto podría ir en un startup event)
+# Configurar sensores (se inician en el startup event, dentro del event loop de uvicorn)
 gestor.agregar_sensor("SENSOR_01", interval=0.8, buffer_size=150)
 gestor.agregar_sensor("SENSOR_02", interval=1.2, buffer_size=150)
 gestor.agregar_sensor("SENSOR_03", interval=1.0, buffer_size=150)
-gestor.iniciar_todos()
 
 class ConnectionManager:
+    MAX_CONNECTIONS = 500
+    SEND_TIMEOUT = 5.0
+    QUEUE_SIZE = 16
+
     def __init__(self):
         self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
+        # Cola de salida y tarea escritora por cliente: un cliente lento no frena al resto
+        self.colas: Dict[WebSocket, asyncio.Queue] = {}
+        self.escritores: Dict[WebSocket, asyncio.Task] = {}
+
+    async def connect(self, websocket: WebSocket) -> bool:
+        # Límite de conexiones para acotar memoria y descriptores
+        if len(self.active_connections) >= self.MAX_CONNECTIONS:
+            await websocket.close(code=1013)  # Try Again Later
+            return False
         await websocket.accept()
         self.active_connections.append(websocket)
+        self.colas[websocket] = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self.escritores[websocket] = asyncio.create_task(self._writer(websocket))
+        return True
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        self.colas.pop(websocket, None)
+        escritor = self.escritores.pop(websocket, None)
+        if escritor is not None and escritor is not asyncio.current_task():
+            escritor.cancel()
+
+    async def _writer(self, websocket: WebSocket):
+        cola = self.colas[websocket]
+        while True:
+            message = await cola.get()
+            try:
+                await asyncio.wait_for(websocket.send_text(message), timeout=self.SEND_TIMEOUT)
+            except Exception:
+                # Cliente lento o caído: cerrar el socket (un envío cortado deja la trama a medias)
+                # para que deje de contar como conexión y websocket_endpoint termine
+                self.disconnect(websocket)
+                try:
+                    await asyncio.wait_for(websocket.close(code=1011), timeout=1.0)
+                except Exception:
+                    pass
+                return
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        # Solo se encola; si el cliente va atrasado se descarta su mensaje más antiguo
+        for cola in list(self.colas.values()):
+            try:
+                cola.put_nowait(message)
+            except asyncio.QueueFull:
+                cola.get_nowait()
+                cola.put_nowait(message)
 
 manager = ConnectionManager()
 
 @app.get("/api/sistema", response_model=SistemaDTO)
 async def estado_sistema():
-    estados = gestor.obtener_estado_general()
+    resumen = gestor.obtener_resumen()
 
     # Asegurar que ultima_lectura sea datetime (no string)
-    for estado in estados.values():
+    for estado in resumen["sensores"].values():
         if isinstance(estado["ultima_lectura"], str):
             try:
                 estado["ultima_lectura"] = datetime.strptime(estado["ultima_lectura"], "%H:%M:%S")
             except ValueError:
                 estado["ultima_lectura"] = datetime.now()  # fallback seguro
 
-    total_lecturas = sum(e['total_lecturas'] for e in estados.values())
-    total_anomalias = sum(e['total_anomalias'] for e in estados.values())
-
-    return {
-        "sensores": estados,
-        "total_lecturas": total_lecturas,
-        "total_anomalias": total_anomalias,
-        "tasa_global_anomalias": (total_anomalias / total_lecturas) * 100 if total_lecturas > 0 else 0
-    }
+    return resumen
 
 @app.get("/api/sensores/{sensor_id}/lecturas", response_model=List[LecturaSensorDTO])
 async def obtener_lecturas(sensor_id: str, limit: int = 10):
@@ -66,24 +101,40 @@ async def obtener_lecturas(sensor_id: str, limit: int = 10):
         return sensor.obtener_ultimas_lecturas(limit)
     return []
 
+async def producir_resumen():
+    """Construye el resumen una vez por segundo y lo reparte a todos los clientes"""
+    while True:
+        await asyncio.sleep(1)
+        if not manager.active_connections:
+            continue
+        try:
+            payload = orjson.dumps(gestor.obtener_resumen(), option=orjson.OPT_SERIALIZE_NUMPY)
+            await manager.broadcast(payload.decode())
+        except Exception as e:
+            print(f"⚠ Error enviando resumen: {e}")
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    if not await manager.connect(websocket):
+        return
     try:
+        # Las actualizaciones las envía producir_resumen; aquí solo se espera la desconexión
+        # (receive() acepta también tramas binarias, que receive_text() no admite)
         while True:
-            # Enviar actualizaciones cada segundo
-            estados = gestor.obtener_estado_general()
-            sistema_dto = SistemaDTO(
-                sensores=estados,
-                total_lecturas=sum(e['total_lecturas'] for e in estados.values()),
-                total_anomalias=sum(e['total_anomalias'] for e in estados.values()),
-                tasa_global_anomalias=sum(e['total_anomalias'] for e in estados.values())/sum(e['total_lecturas'] for e in estados.values()) if sum(e['total_lecturas'] for e in estados.values()) > 0 else 0
-            )
-            await websocket.send_json(sistema_dto.dict())
-            await asyncio.sleep(1)
-    except WebSocketDisconnect:
+            mensaje = await websocket.receive()
+            if mensaje["type"] == "websocket.disconnect":
+                break
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # Socket ya cerrado (p. ej. por el escritor tras un envío fallido)
+    finally:
         manager.disconnect(websocket)
 
+@app.on_event("startup")
+async def startup_event():
+    await gestor.iniciar_todos_async()
+    app.state.productor = asyncio.create_task(producir_resumen())
+
 @app.on_event("shutdown")
 def shutdown_event():
+    app.state.productor.cancel()
     gestor.detener_todos()
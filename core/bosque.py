@@ -0,0 +1,92 @@
+# core/bosque.py
+import numpy as np
+
+
+def _longitud_media(n):
+    # Longitud media de camino de una búsqueda fallida en un BST con n muestras
+    n = np.asarray(n, dtype=np.float64)
+    c = np.zeros_like(n)
+    c[n == 2] = 1.0
+    m = n > 2
+    c[m] = 2.0 * (np.log(n[m] - 1.0) + np.euler_gamma) - 2.0 * (n[m] - 1.0) / n[m]
+    return c
+
+
+class BosqueCompilado:
+    """IsolationForest aplanado en arrays de NumPy para puntuar sin pasar por sklearn"""
+
+    def __init__(self, modelo, scaler=None):
+        """
+        Compila un IsolationForest ya entrenado
+
+        Args:
+            modelo (IsolationForest): Modelo de sklearn cargado con joblib
+            scaler (StandardScaler): Si se indica, se integra en los umbrales y el
+                bosque recibe directamente las lecturas sin escalar
+        """
+        izquierdos, derechos, features, umbrales, valores, raices = [], [], [], [], [], []
+        offset = 0
+        profundidad_max = 0
+
+        for arbol, columnas in zip(modelo.estimators_, modelo.estimators_features_):
+            t = arbol.tree_
+            n = t.node_count
+            hojas = t.children_left == -1
+            nodos = np.arange(n)
+
+            # Profundidad de cada nodo (los hijos siempre tienen índice mayor que el padre)
+            profundidad = np.zeros(n, dtype=np.float64)
+            for i in range(n):
+                if not hojas[i]:
+                    profundidad[t.children_left[i]] = profundidad[i] + 1
+                    profundidad[t.children_right[i]] = profundidad[i] + 1
+
+            # Las hojas apuntan a sí mismas: recorrer de más no cambia el resultado
+            izquierdos.append(np.where(hojas, nodos, t.children_left) + offset)
+            derechos.append(np.where(hojas, nodos, t.children_right) + offset)
+            features.append(np.where(hojas, 0, np.asarray(columnas)[np.maximum(t.feature, 0)]))
+            umbrales.append(t.threshold)
+            # Aristas hasta la hoja + corrección por las muestras que quedaron en ella
+            valores.append(np.where(hojas, profundidad + _longitud_media(t.n_node_samples), 0.0))
+            raices.append(offset)
+
+            offset += n
+            profundidad_max = max(profundidad_max, t.max_depth)
+
+        self.izquierdos = np.concatenate(izquierdos).astype(np.intp)
+        self.derechos = np.concatenate(derechos).astype(np.intp)
+        self.features = np.concatenate(features).astype(np.intp)
+        self.umbrales = np.concatenate(umbrales)
+        if scaler is not None:
+            # (x - mean) / scale <= u  <=>  x <= u * scale + mean  (scale > 0)
+            self.umbrales = self.umbrales * scaler.scale_[self.features] + scaler.mean_[self.features]
+        # Las entradas son float32: x <= u equivale a x <= (mayor float32 que no supera u),
+        # así que los umbrales se guardan en float32 sin cambiar ninguna decisión
+        umbrales32 = self.umbrales.astype(np.float32)
+        redondeados_arriba = umbrales32 > self.umbrales
+        umbrales32[redondeados_arriba] = np.nextafter(umbrales32[redondeados_arriba], np.float32(-np.inf))
+        self.umbrales = umbrales32
+        self.valores = np.concatenate(valores)
+        self.raices = np.asarray(raices, dtype=np.intp)
+        self.profundidad_max = profundidad_max
+        self.offset = float(modelo.offset_)
+        self.normalizador = len(raices) * float(_longitud_media([modelo.max_samples_])[0])
+
+    def decision_function(self, X):
+        """Equivalente a IsolationForest.decision_function (X escalado salvo que se integrara el scaler)"""
+        # Entradas y umbrales en float32: la mitad de memoria en cada nivel recorrido
+        X = np.asarray(X, dtype=np.float32)
+        filas = np.arange(len(X))[:, None]
+        nodos = np.broadcast_to(self.raices, (len(X), len(self.raices)))
+
+        # Todos los árboles avanzan un nivel a la vez
+        for _ in range(self.profundidad_max):
+            a_izquierda = X[filas, self.features[nodos]] <= self.umbrales[nodos]
+            nodos = np.where(a_izquierda, self.izquierdos[nodos], self.derechos[nodos])
+
+        caminos = self.valores[nodos].sum(axis=1)
+        return -(2.0 ** (-caminos / self.normalizador)) - self.offset
+
+    def predict(self, X):
+        """Devuelve -1 para anomalías y 1 para datos normales"""
+        return np.where(self.decision_function(X) < 0, -1, 1)
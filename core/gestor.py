@@ -1,27 +1,56 @@
+import asyncio
+import heapq
+import sys
 import time
-import queue
+from collections import deque
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from core.sensor import SensorIoT
+from core.modelo import FUENTES_POR_MASCARA, iniciar_worker, puntuar_lote
 
 class GestorSensores:
     """Gestor centralizado para múltiples sensores"""
     
-    def __init__(self, modelo_anomalias):
+    def __init__(self, modelo_anomalias, procesos_puntuacion=0):
         """
         Inicializa el gestor de sensores
         
         Args:
             modelo_anomalias (ModeloAnomalias): Instancia del modelo de detección
+            procesos_puntuacion (int): Procesos para puntuar los lotes fuera del GIL
+                (0 = en el propio event loop; solo compensa con lotes grandes)
         """
         self.modelo_anomalias = modelo_anomalias
         self.sensores = {}
-        self.data_queue_global = queue.Queue()
+        self.data_queue_global = deque()
         self.monitor_thread = None
         self.monitoring = False
+        # Alertas pendientes de imprimir: el monitor las encola y un thread las escribe
+        self._alertas_pendientes = deque()
+        self._evento_alertas = threading.Event()
+        self._hilo_alertas = None
+        # Los sensores lo activan al publicar una lectura: el monitor espera sin sondear
+        self._evento_datos = threading.Event()
+        
+        # Event loop donde corren los sensores (el de FastAPI o uno propio en un thread)
+        self._loop = None
+        self._loop_thread = None
+        
+        # Planificador único: agenda (instante, sensor_id) de la próxima lectura de cada sensor
+        self._agenda = []
+        self._programados = set()
+        self._despertar = None
+        self._tarea_planificador = None
+        self.procesos_puntuacion = procesos_puntuacion
+        self._executor = None
+        self.intervalo_lote = 0.05  # Lecturas que vencen dentro de esta ventana van al mismo lote (segundos)
     
     def agregar_sensor(self, sensor_id, interval=1.0, buffer_size=100):
         """Agrega un nuevo sensor al sistema"""
         if sensor_id not in self.sensores:
-            sensor = SensorIoT(sensor_id, self.modelo_anomalias, interval, buffer_size)
+            sensor = SensorIoT(sensor_id, self.modelo_anomalias, interval, buffer_size,
+                               evento_datos=self._evento_datos)
             self.sensores[sensor_id] = sensor
             print(f"➕ Sensor {sensor_id} agregado al sistema")
             return True
@@ -32,7 +61,12 @@ class GestorSensores:
     def iniciar_sensor(self, sensor_id):
         """Inicia un sensor específico"""
         if sensor_id in self.sensores:
-            return self.sensores[sensor_id].iniciar()
+            loop = self._obtener_loop()
+            self._iniciar_planificador()
+            if self.sensores[sensor_id].iniciar():
+                # Funciona tanto desde el propio loop como desde otro thread
+                loop.call_soon_threadsafe(self._programar, sensor_id)
+                return True
         return False
     
     def detener_sensor(self, sensor_id):
@@ -47,12 +81,143 @@ class GestorSensores:
             self.iniciar_sensor(sensor_id)
         print(f"🚀 {len(self.sensores)} sensores iniciados")
     
+    async def iniciar_todos_async(self):
+        """Inicia todos los sensores en el event loop en ejecución (p. ej. el de FastAPI)"""
+        self._loop = asyncio.get_running_loop()
+        self.iniciar_todos()
+    
     def detener_todos(self):
         """Detiene todos los sensores"""
         for sensor_id in self.sensores:
             self.detener_sensor(sensor_id)
+        self._detener_planificador()
+        self._detener_loop_propio()
         print(f"⏹ {len(self.sensores)} sensores detenidos")
     
+    def _obtener_loop(self):
+        """Devuelve el event loop de los sensores, creando uno propio si no hay ninguno"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(target=self._loop.run_forever)
+            self._loop_thread.daemon = True
+            self._loop_thread.start()
+        return self._loop
+    
+    def _detener_loop_propio(self):
+        """Detiene el event loop creado por el gestor (no el de FastAPI)"""
+        if self._loop_thread is not None:
+            try:
+                # Dejar que las tareas canceladas terminen antes de parar el loop
+                asyncio.run_coroutine_threadsafe(self._esperar_tareas(), self._loop).result(timeout=2)
+            except Exception as e:
+                print(f"⚠ Error cerrando tareas: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join(timeout=2)
+            self._loop.close()
+            self._loop = None
+            self._loop_thread = None
+    
+    async def _esperar_tareas(self):
+        """Espera a que terminen las tareas pendientes del loop"""
+        tareas = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        await asyncio.gather(*tareas, return_exceptions=True)
+    
+    def _iniciar_planificador(self):
+        """Inicia la tarea del planificador si no está activa"""
+        if self._tarea_planificador is None:
+            if self.procesos_puntuacion > 0:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.procesos_puntuacion,
+                    initializer=iniciar_worker,
+                    initargs=(self.modelo_anomalias.scaler_path, self.modelo_anomalias.modelo_path)
+                )
+            self._despertar = asyncio.Event()
+            self._tarea_planificador = asyncio.run_coroutine_threadsafe(self._loop_planificador(), self._loop)
+    
+    def _detener_planificador(self):
+        """Detiene la tarea del planificador"""
+        if self._tarea_planificador is not None:
+            self._tarea_planificador.cancel()
+            self._tarea_planificador = None
+        self._agenda.clear()
+        self._programados.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    def _programar(self, sensor_id):
+        """Agenda la primera lectura de un sensor (se ejecuta en el loop de los sensores)"""
+        if sensor_id not in self._programados:
+            self._programados.add(sensor_id)
+            heapq.heappush(self._agenda, (self._loop.time(), sensor_id))
+        self._despertar.set()
+    
+    async def _loop_planificador(self):
+        """Genera las lecturas de todos los sensores según su intervalo y las evalúa por lotes"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Dormir hasta la próxima lectura o hasta que se agende un sensor nuevo
+            espera = self._agenda[0][0] - loop.time() if self._agenda else None
+            if espera is None or espera > 0:
+                self._despertar.clear()
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            # Sacar todos los sensores que vencen ahora (o dentro de la ventana del lote)
+            ahora = loop.time()
+            vencidos = []
+            reprogramados = []
+            while self._agenda and self._agenda[0][0] <= ahora + self.intervalo_lote:
+                siguiente, sensor_id = heapq.heappop(self._agenda)
+                sensor = self.sensores[sensor_id]
+                if not sensor.running:
+                    self._programados.discard(sensor_id)  # Detenido: sale de la agenda
+                    continue
+                vencidos.append(sensor)
+                
+                # El tiempo de proceso no alarga el periodo; si vamos atrasados, reiniciar la cadencia
+                reprogramados.append((max(siguiente + sensor.interval, ahora), sensor_id))
+            
+            # Se vuelven a agendar después de sacar el lote: cada sensor aparece una sola vez
+            # por lote aunque su intervalo sea menor que intervalo_lote
+            for entrada in reprogramados:
+                heapq.heappush(self._agenda, entrada)
+            
+            if vencidos:
+                try:
+                    await self._procesar_lote(vencidos)
+                except Exception as e:
+                    print(f"❌ Error en el planificador: {e}")
+    
+    async def _procesar_lote(self, sensores):
+        """Genera una lectura por sensor y evalúa las reglas y el modelo en un solo lote"""
+        lecturas = [sensor._generar_lectura_sensor() for sensor in sensores]
+        anteriores = [sensor.eficiencia_anterior() for sensor in sensores]
+        
+        # Una fila por lectura; las reglas y el modelo se evalúan vectorizados
+        X = np.array([[l['temperatura_c'], l['voltaje_v'], l['eficiencia_pct']] for l in lecturas])
+        efic_ant = np.array([np.nan if e is None else e for e in anteriores])
+        try:
+            if self._executor is not None:
+                mascaras = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, puntuar_lote, X.tobytes(), efic_ant.tobytes()
+                )
+            else:
+                mascaras = self.modelo_anomalias.verificar_estado_batch(X, efic_ant, requiere_modelo=False)
+            mascaras = mascaras.tolist()
+        except Exception as e:
+            print(f"⚠ Error puntuando lote: {e}")
+            mascaras = [None] * len(lecturas)  # Cada sensor evaluará su lectura por separado
+        
+        for sensor, lectura, efic_anterior, mascara in zip(sensores, lecturas, anteriores, mascaras):
+            try:
+                sensor._procesar_lectura(lectura, efic_anterior, mascara)
+            except Exception as e:
+                print(f"❌ [{sensor.sensor_id}] Error: {e}")
+    
     def obtener_estado_general(self):
         """Obtiene el estado de todos los sensores"""
         estados = {}
@@ -60,44 +225,89 @@ class GestorSensores:
             estados[sensor_id] = sensor.obtener_estado()
         return estados
     
+    def obtener_resumen(self):
+        """Obtiene el estado de los sensores junto con los totales del sistema"""
+        estados = self.obtener_estado_general()
+        total_lecturas = sum(e['total_lecturas'] for e in estados.values())
+        total_anomalias = sum(e['total_anomalias'] for e in estados.values())
+        return {
+            'sensores': estados,
+            'total_lecturas': total_lecturas,
+            'total_anomalias': total_anomalias,
+            'tasa_global_anomalias': (total_anomalias / total_lecturas) * 100 if total_lecturas > 0 else 0
+        }
+    
+    def _formatear_alerta(self, sensor_id, lectura):
+        """Texto de una alerta para la consola"""
+        texto = (f"\n🚨 ALERTA [{sensor_id}] - {lectura['timestamp']:%H:%M:%S}\n"
+                 f"   📊 T: {lectura['temperatura_c']:.1f}°C | "
+                 f"V: {lectura['voltaje_v']:.1f}V | "
+                 f"E: {lectura['eficiencia_pct']:.1f}%\n"
+                 f"   🎯 Fuentes: {', '.join(FUENTES_POR_MASCARA[lectura['alerta_mask']])}\n")
+        if lectura['delta_efic'] is not None:
+            texto += f"   📉 Δ Eficiencia: {lectura['delta_efic']:.2f}%\n"
+        return texto
+    
+    def _escribir_alertas(self):
+        """Thread que formatea e imprime las alertas encoladas por el monitor, por tandas"""
+        pendientes = self._alertas_pendientes
+        while self.monitoring or pendientes:
+            self._evento_alertas.wait()
+            self._evento_alertas.clear()
+            textos = []
+            while pendientes:
+                textos.append(self._formatear_alerta(*pendientes.popleft()))
+            if textos:
+                # Una sola escritura por tanda
+                sys.stdout.write("".join(textos))
+                sys.stdout.flush()
+    
     def mostrar_alertas_tiempo_real(self, duracion_segundos=30):
         """Monitorea y muestra alertas en tiempo real"""
         print(f"🔍 Monitoreando alertas por {duracion_segundos} segundos...")
-        inicio = time.time()
-        ultima_actualizacion_estado = 0
+        # Tiempos en nanosegundos enteros del reloj monotónico (inmune a ajustes de NTP)
+        inicio = time.monotonic_ns()
+        fin = inicio + int(duracion_segundos * 1_000_000_000)
+        intervalo_estado = 10_000_000_000  # Mostrar estado cada 10 segundos
+        ultima_actualizacion_estado = inicio - intervalo_estado
         
-        while time.time() - inicio < duracion_segundos:
-            tiempo_actual = time.time()
-            
-            # Revisar alertas de cada sensor
-            for sensor_id, sensor in self.sensores.items():
-                if not sensor.data_queue.empty():
-                    try:
-                        lectura = sensor.data_queue.get_nowait()
+        # Las alertas se imprimen desde otro thread: el vaciado de las colas no espera a la consola
+        self.monitoring = True
+        self._hilo_alertas = threading.Thread(target=self._escribir_alertas, daemon=True)
+        self._hilo_alertas.start()
+        
+        try:
+            while time.monotonic_ns() < fin:
+                tiempo_actual = time.monotonic_ns()
+                self._evento_datos.clear()  # Antes de vaciar las colas: no se pierde ningún aviso
+                
+                # Revisar alertas de cada sensor
+                for sensor_id, sensor in self.sensores.items():
+                    cola = sensor.data_queue
+                    while cola:
+                        lectura = cola.popleft()
                         
                         if lectura['alerta_total']:
-                            timestamp = lectura['timestamp'].strftime('%H:%M:%S')
-                            print(f"\n🚨 ALERTA [{sensor_id}] - {timestamp}")
-                            print(f"   📊 T: {lectura['temperatura_c']:.1f}°C | "
-                                  f"V: {lectura['voltaje_v']:.1f}V | "
-                                  f"E: {lectura['eficiencia_pct']:.1f}%")
-                            print(f"   🎯 Fuentes: {', '.join(lectura['fuente_alerta'])}")
-                            
-                            if lectura['delta_efic'] is not None:
-                                print(f"   📉 Δ Eficiencia: {lectura['delta_efic']:.2f}%")
-                    
-                    except queue.Empty:
-                        pass
-            
-            # Mostrar estado cada 10 segundos
-            if tiempo_actual - ultima_actualizacion_estado >= 10:
-                print(f"\n📈 Estado del Sistema ({int(tiempo_actual - inicio)}s)")
-                estados = self.obtener_estado_general()
-                for sensor_id, estado in estados.items():
-                    print(f"   [{sensor_id}]: {estado['total_lecturas']} lecturas, "
-                          f"{estado['total_anomalias']} anomalías "
-                          f"({estado['tasa_anomalias_pct']:.1f}%)")
-                ultima_actualizacion_estado = tiempo_actual
-            
-            time.sleep(0.1)
-
+                            self._alertas_pendientes.append((sensor_id, lectura))
+                            self._evento_alertas.set()
+                
+                # Mostrar estado cada 10 segundos
+                if tiempo_actual - ultima_actualizacion_estado >= intervalo_estado:
+                    print(f"\n📈 Estado del Sistema ({(tiempo_actual - inicio) // 1_000_000_000}s)")
+                    estados = self.obtener_estado_general()
+                    for sensor_id, estado in estados.items():
+                        print(f"   [{sensor_id}]: {estado['total_lecturas']} lecturas, "
+                              f"{estado['total_anomalias']} anomalías "
+                              f"({estado['tasa_anomalias_pct']:.1f}%)")
+                    ultima_actualizacion_estado = tiempo_actual
+                
+                # Esperar nuevas lecturas, el próximo estado o el final del monitoreo
+                espera = min(fin, ultima_actualizacion_estado + intervalo_estado) - time.monotonic_ns()
+                if espera > 0:
+                    self._evento_datos.wait(espera / 1_000_000_000)
+        finally:
+            # Terminar de imprimir las alertas pendientes
+            self.monitoring = False
+            self._evento_alertas.set()
+            self._hilo_alertas.join()
+            self._hilo_alertas = None
@@ -0,0 +1,133 @@
+# core/hst.py
+import numpy as np
+from core.modelo import ModeloAnomalias
+
+
+class ModeloHalfSpaceTrees(ModeloAnomalias):
+    """
+    Detector en línea con Half-Space Trees (Tan et al., 2011)
+
+    A diferencia del IsolationForest entrenado, aprende de cada lectura y se adapta
+    a la deriva de los sensores. Mantiene estado: no usar con procesos_puntuacion > 0.
+    """
+
+    __slots__ = (
+        'n_arboles', 'altura', 'ventana', 'umbral', '_limite_masa', '_max_puntuacion',
+        '_features', '_cortes', '_masa_ref', '_masa_actual', '_contador', '_listo', '_arboles'
+    )
+
+    def __init__(self, scaler_path="models/scaler_datos.pkl", n_arboles=25, altura=8,
+                 ventana=250, umbral=0.9, semilla=None):
+        """
+        Inicializa el detector
+
+        Args:
+            scaler_path (str): StandardScaler entrenado, usado para normalizar a [0, 1]
+            n_arboles (int): Número de árboles
+            altura (int): Altura de cada árbol
+            ventana (int): Lecturas por ventana de referencia
+            umbral (float): Puntuación normalizada (0-1) a partir de la cual hay anomalía
+            semilla (int): Semilla para construir los árboles
+        """
+        self.n_arboles = n_arboles
+        self.altura = altura
+        self.ventana = ventana
+        self.umbral = umbral
+        self._limite_masa = 0.1 * ventana
+        self._max_puntuacion = n_arboles * ventana * 2.0 ** altura
+        self._construir_arboles(np.random.default_rng(semilla))
+        super().__init__(scaler_path=scaler_path, modelo_path=None)
+
+    def _cargar_modelos(self):
+        # Solo se necesita el scaler; los árboles se construyen aleatoriamente
+        try:
+            self._cargar_scaler()
+            self.modelo_cargado = True
+            print("✅ Half-Space Trees inicializado")
+        except Exception as e:
+            print(f"❌ Error cargando scaler: {e}")
+
+    def _construir_arboles(self, rng):
+        # Árboles binarios completos guardados por niveles: hijos de i en 2i+1 y 2i+2
+        n_nodos = 2 ** (self.altura + 1) - 1
+        self._features = np.zeros((self.n_arboles, n_nodos), dtype=np.intp)
+        self._cortes = np.zeros((self.n_arboles, n_nodos), dtype=np.float32)
+
+        for t in range(self.n_arboles):
+            # Espacio de trabajo aleatorio que contiene [0, 1] en cada dimensión
+            s = rng.random(3)
+            rango = 2 * np.maximum(s, 1 - s)
+            pendientes = [(0, s - rango, s + rango, 0)]
+            while pendientes:
+                i, bajo, alto, nivel = pendientes.pop()
+                if nivel == self.altura:
+                    continue
+                q = rng.integers(3)
+                corte = (bajo[q] + alto[q]) / 2
+                self._features[t, i] = q
+                self._cortes[t, i] = corte
+                alto_izq = alto.copy()
+                alto_izq[q] = corte
+                bajo_der = bajo.copy()
+                bajo_der[q] = corte
+                pendientes.append((2 * i + 1, bajo, alto_izq, nivel + 1))
+                pendientes.append((2 * i + 2, bajo_der, alto, nivel + 1))
+
+        # Masa de la ventana de referencia (r) y de la ventana en curso (l)
+        self._masa_ref = np.zeros((self.n_arboles, n_nodos))
+        self._masa_actual = np.zeros((self.n_arboles, n_nodos))
+        self._contador = 0
+        self._listo = False
+        self._arboles = np.arange(self.n_arboles)
+
+    def _caminos(self, U):
+        # Nodos visitados por cada lectura en cada árbol: (N, árboles, altura + 1)
+        filas = np.arange(len(U))[:, None]
+        nodos = np.zeros((len(U), self.n_arboles), dtype=np.intp)
+        caminos = np.zeros((len(U), self.n_arboles, self.altura + 1), dtype=np.intp)
+        for nivel in range(self.altura):
+            a_derecha = U[filas, self._features[self._arboles, nodos]] >= self._cortes[self._arboles, nodos]
+            nodos = 2 * nodos + 1 + a_derecha
+            caminos[:, :, nivel + 1] = nodos
+        return caminos
+
+    def _puntuar_y_aprender(self, U):
+        caminos = self._caminos(U)
+        arboles = np.broadcast_to(self._arboles[None, :, None], caminos.shape)
+
+        # Puntuación: masa de referencia del primer nodo con poca masa (o la hoja) * 2^nivel
+        masa = self._masa_ref[arboles, caminos]
+        terminal = masa < self._limite_masa
+        terminal[:, :, -1] = True
+        nivel = terminal.argmax(axis=2)
+        masa_terminal = np.take_along_axis(masa, nivel[..., None], axis=2)[..., 0]
+        puntuacion = 1.0 - (masa_terminal * 2.0 ** nivel).sum(axis=1) / self._max_puntuacion
+
+        # Aprendizaje: sumar masa en la ventana actual y rotar al completarla
+        np.add.at(self._masa_actual, (arboles, caminos), 1)
+        self._contador += len(U)
+        if self._contador >= self.ventana:
+            self._masa_ref = self._masa_actual
+            self._masa_actual = np.zeros_like(self._masa_ref)
+            self._contador = 0
+            self._listo = True
+
+        return puntuacion
+
+    def predecir_lote(self, X):
+        # X: array (N, 3) sin escalar; devuelve las filas anómalas y aprende de ellas
+        if not self.modelo_cargado:
+            return np.zeros(len(X), dtype=bool)
+        Z = (np.asarray(X, dtype=np.float32) - self._mean) * self._inv_scale
+        U = (np.clip(Z, -4, 4) + 4) / 8
+        with self._lock:
+            listo = self._listo  # Sin ventana de referencia completa no se alerta
+            puntuacion = self._puntuar_y_aprender(U)
+        return (puntuacion > self.umbral) & listo
+
+    def _predecir_uno(self, temp, volt, efic):
+        try:
+            return int(self.predecir_lote([[temp, volt, efic]])[0])
+        except Exception as e:
+            print(f"⚠ Error modelo: {e}")
+            return 0
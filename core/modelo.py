@@ -1,59 +1,180 @@
 # core/modelo.py
 import joblib
 import numpy as np
-import pandas as pd
+import threading
 from sklearn.exceptions import InconsistentVersionWarning
 import warnings
+from core.bosque import BosqueCompilado
 
 warnings.filterwarnings("ignore", category=InconsistentVersionWarning)
 
+# Alertas individuales y su nombre como fuente (el índice es el bit en las máscaras)
+ALERTAS = ("modelo_ml", "bajo_voltaje", "alta_temperatura", "caida_eficiencia")
+FUENTES = ("Modelo_ML", "Bajo_Voltaje", "Alta_Temperatura", "Caida_Eficiencia")
+ALERTA_MODELO, ALERTA_VOLTAJE, ALERTA_TEMPERATURA, ALERTA_EFICIENCIA = 1, 2, 4, 8
+
+# Traducción precalculada de cada máscara a fuentes y alertas individuales
+FUENTES_POR_MASCARA = tuple(
+    tuple(f for bit, f in enumerate(FUENTES) if m >> bit & 1) or ("Normal",)
+    for m in range(1 << len(FUENTES))
+)
+ALERTAS_POR_MASCARA = tuple(
+    {a: bool(m >> bit & 1) for bit, a in enumerate(ALERTAS)}
+    for m in range(1 << len(ALERTAS))
+)
+
 class ModeloAnomalias:
+    # Atributos fijos: sin __dict__ por instancia
+    __slots__ = (
+        'scaler_path', 'modelo_path', 'modelo_cargado', '_feature_names', '_buf', '_lock',
+        'min_lote_paralelo', 'scaler', 'modelo', '_mean', '_inv_scale', '_predictor', '_escalar'
+    )
+
     def __init__(self, scaler_path="models/scaler_datos.pkl", modelo_path="models/modelo_isolation_forest.pkl"):
         self.scaler_path = scaler_path
         self.modelo_path = modelo_path
         self.modelo_cargado = False
+        # Orden de columnas usado en el entrenamiento del scaler
+        self._feature_names = ['Temperatura_C', 'Voltaje_V', 'Eficiencia_%']
+        # Buffer reutilizado en cada lectura (evita construir un DataFrame por tick)
+        self._buf = np.empty((1, 3), dtype=np.float32)
+        # Los sensores comparten el modelo desde varios threads
+        self._lock = threading.Lock()
+        # Tamaño de lote a partir del cual sklearn reparte los árboles entre threads
+        self.min_lote_paralelo = 2000
         self._cargar_modelos()
 
     def _cargar_modelos(self):
         try:
-            self.scaler = joblib.load(self.scaler_path)
+            self._cargar_scaler()
             self.modelo = joblib.load(self.modelo_path)
+            self._compilar_bosque()
             self.modelo_cargado = True
             print("✅ Modelos cargados correctamente")
         except Exception as e:
             print(f"❌ Error cargando modelos: {e}")
 
-    def verificar_estado_completo(self, temp, volt, efic, efic_ant=None):
-        alerta_modelo = 0
-        if self.modelo_cargado:
-            try:
-                entrada = pd.DataFrame([[temp, volt, efic]], columns=['Temperatura_C', 'Voltaje_V', 'Eficiencia_%'])
-                entrada_scaled = self.scaler.transform(entrada)
-                pred = self.modelo.predict(entrada_scaled)
-                alerta_modelo = int(pred[0] == -1)
-            except Exception as e:
-                print(f"⚠ Error modelo: {e}")
-
-        alerta_voltaje = int(volt < 210)
-        alerta_temp = int(temp > 80)
-        alerta_eficiencia = int((efic - efic_ant) < -2.0) if efic_ant is not None else 0
-
-        fuentes = []
-        if alerta_modelo: fuentes.append("Modelo_ML")
-        if alerta_voltaje: fuentes.append("Bajo_Voltaje")
-        if alerta_temp: fuentes.append("Alta_Temperatura")
-        if alerta_eficiencia: fuentes.append("Caida_Eficiencia")
-        if not fuentes: fuentes = ["Normal"]
+    def _cargar_scaler(self):
+        self.scaler = joblib.load(self.scaler_path)
+        # Parámetros del StandardScaler para escalar directamente en NumPy, sin
+        # pasar por transform() (float32: el bosque compara en float32 de todas formas)
+        self._mean = np.asarray(self.scaler.mean_, dtype=np.float32)
+        self._inv_scale = (1.0 / np.asarray(self.scaler.scale_, dtype=np.float64)).astype(np.float32)
+
+    def _compilar_bosque(self):
+        # El bosque compilado integra el scaler en sus umbrales: una sola llamada
+        # puntúa las lecturas sin escalar y sin pasar por sklearn
+        try:
+            bosque = BosqueCompilado(self.modelo, self.scaler)
+            self._verificar_bosque(bosque)
+            self._predictor = bosque
+            self._escalar = False
+        except Exception as e:
+            print(f"⚠ No se pudo compilar el bosque, se usará sklearn: {e}")
+            self._predictor = self.modelo
+            self._escalar = True
+
+    def _verificar_bosque(self, bosque):
+        # El bosque compilado replica detalles internos de sklearn: comprobar al cargar
+        # que puntúa igual que el modelo original (si no, se usa sklearn)
+        rng = np.random.default_rng(0)
+        X = (self._mean + rng.normal(0.0, 2.0, (32, 3)).astype(np.float32) / self._inv_scale).astype(np.float32)
+        esperado = self.modelo.decision_function((X - self._mean) * self._inv_scale)
+        obtenido = bosque.decision_function(X)
+        if not np.allclose(obtenido, esperado, atol=1e-6):
+            raise ValueError(f"difiere de sklearn (máx. {np.abs(obtenido - esperado).max():.2e})")
+
+    def predecir_lote(self, X):
+        # X: array (N, 3) con columnas en el orden de self._feature_names
+        if not self.modelo_cargado:
+            return np.zeros(len(X), dtype=bool)
+        X = np.asarray(X, dtype=np.float32)
+        if self._escalar:
+            X = (X - self._mean) * self._inv_scale
+            if len(X) >= self.min_lote_paralelo:
+                # Ruta sklearn con lotes grandes: recorrer los árboles en paralelo
+                # (backend de threads: no copia el bosque y el código Cython libera el GIL)
+                with joblib.parallel_backend("threading", n_jobs=-1):
+                    return self._predictor.decision_function(X) < 0
+        # predict() es decision_function() < 0: una sola pasada por el bosque
+        return self._predictor.decision_function(X) < 0
 
+    def mascara_reglas(self, temp, volt, efic, efic_ant=None):
+        # Reglas fijas (bajo voltaje, alta temperatura, caída de eficiencia) como bits de ALERTAS
+        mascara = 0
+        if volt < 210: mascara |= ALERTA_VOLTAJE
+        if temp > 80: mascara |= ALERTA_TEMPERATURA
+        if efic_ant is not None and (efic - efic_ant) < -2.0: mascara |= ALERTA_EFICIENCIA
+        return mascara
+
+    def _predecir_uno(self, temp, volt, efic):
+        if not self.modelo_cargado:
+            return 0
+        try:
+            with self._lock:
+                buf = self._buf
+                buf[0, 0] = temp
+                buf[0, 1] = volt
+                buf[0, 2] = efic
+                if self._escalar:
+                    buf -= self._mean
+                    buf *= self._inv_scale
+                pred = self._predictor.predict(buf)
+            return int(pred[0] == -1)
+        except Exception as e:
+            print(f"⚠ Error modelo: {e}")
+            return 0
+
+    def componer_resultado(self, mascara, delta_efic=None):
+        # Resultado compacto de una lectura: las fuentes y alertas individuales se
+        # obtienen de la máscara solo al exponerla (FUENTES_POR_MASCARA / ALERTAS_POR_MASCARA)
         return {
-            "alerta_total": bool(alerta_modelo or alerta_voltaje or alerta_temp or alerta_eficiencia),
-            "fuente_alerta": fuentes,
-            "delta_efic": (efic - efic_ant) if efic_ant is not None else None,
-            "alertas_individuales": {
-                "modelo_ml": bool(alerta_modelo),
-                "bajo_voltaje": bool(alerta_voltaje),
-                "alta_temperatura": bool(alerta_temp),
-                "caida_eficiencia": bool(alerta_eficiencia)
-            }
+            "alerta_total": mascara != 0,
+            "alerta_mask": mascara,
+            "delta_efic": delta_efic
         }
 
+    def verificar_estado_completo(self, temp, volt, efic, efic_ant=None, alerta_modelo=None, requiere_modelo=True):
+        mascara = self.mascara_reglas(temp, volt, efic, efic_ant)
+
+        # alerta_modelo puede venir ya calculada por un lote (GestorSensores)
+        if alerta_modelo is None:
+            if not requiere_modelo and mascara:
+                alerta_modelo = 0  # La alerta ya está garantizada por las reglas
+            else:
+                alerta_modelo = self._predecir_uno(temp, volt, efic)
+        if alerta_modelo:
+            mascara |= ALERTA_MODELO
+
+        return self.componer_resultado(mascara, (efic - efic_ant) if efic_ant is not None else None)
+
+    def verificar_estado_batch(self, X, efic_ant, requiere_modelo=True):
+        # X: array (N, 3) [temp, volt, efic]; efic_ant: array (N,) con NaN si no hay lectura anterior
+        # Devuelve las máscaras de alertas (uint8) de las N lecturas
+        X = np.asarray(X, dtype=np.float64)
+        temp, volt, efic = X[:, 0], X[:, 1], X[:, 2]
+        mascara = (
+            (volt < 210) * ALERTA_VOLTAJE
+            | (temp > 80) * ALERTA_TEMPERATURA
+            | ((efic - np.asarray(efic_ant, dtype=np.float64)) < -2.0) * ALERTA_EFICIENCIA
+        ).astype(np.uint8)
+
+        # El modelo solo se consulta donde hace falta
+        evaluar = slice(None) if requiere_modelo else mascara == 0
+        X_modelo = X[evaluar]
+        if len(X_modelo):
+            mascara[evaluar] |= self.predecir_lote(X_modelo).astype(np.uint8) * ALERTA_MODELO
+        return mascara
+
+# Puntuación en procesos separados (ver GestorSensores): cada worker carga su propio modelo
+_modelo_worker = None
+
+def iniciar_worker(scaler_path, modelo_path):
+    global _modelo_worker
+    _modelo_worker = ModeloAnomalias(scaler_path, modelo_path)
+
+def puntuar_lote(X_bytes, efic_ant_bytes):
+    # Los arrays llegan como bytes contiguos para abaratar el paso entre procesos
+    X = np.frombuffer(X_bytes, dtype=np.float64).reshape(-1, 3)
+    efic_ant = np.frombuffer(efic_ant_bytes, dtype=np.float64)
+    return _modelo_worker.verificar_estado_batch(X, efic_ant, requiere_modelo=False)
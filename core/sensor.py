@@ -4,12 +4,59 @@ import threading
 import time
 from datetime import datetime
 from collections import deque
-import queue 
+from core.modelo import ALERTAS, FUENTES_POR_MASCARA, ALERTAS_POR_MASCARA
+
+# Texto de fuentes de alerta para cada combinación de bits
+_TEXTO_FUENTES = np.array([','.join(f) for f in FUENTES_POR_MASCARA], dtype=object)
+
+# Parámetros base de cada sensor simulado:
+# (temp_base, temp_std, volt_base, volt_std, efic_base, efic_std)
+_SENSOR_CONFIGS = {
+    "SENSOR_01": (70.0, 3.0, 220.0, 5.0, 82.0, 3.0),
+    "SENSOR_02": (68.0, 2.5, 218.0, 4.0, 80.0, 2.8),
+    "SENSOR_03": (72.0, 3.5, 222.0, 6.0, 84.0, 3.2),
+}
+
+# Generador compartido por todos los sensores y lecturas pregeneradas por bloque
+rng = np.random.default_rng()
+_TAM_BLOQUE = 4096
+
+# Reserva de bloques compartida: una sola llamada a NumPy rellena los de varios sensores
+# (por lectura: 3 normales para los valores, 3 para las derivas y 3 uniformes para fallos)
+_BLOQUES_POR_RELLENO = 8
+_normales_compartidas = np.empty((_BLOQUES_POR_RELLENO, _TAM_BLOQUE, 6), dtype=np.float32)
+_uniformes_compartidas = np.empty((_BLOQUES_POR_RELLENO, _TAM_BLOQUE, 3), dtype=np.float32)
+_siguiente_bloque = _BLOQUES_POR_RELLENO
+_lock_aleatorios = threading.Lock()
+
+def _tomar_bloque_aleatorio():
+    """Entrega el próximo bloque (normales, uniformes) de la reserva como listas"""
+    global _siguiente_bloque
+    with _lock_aleatorios:
+        if _siguiente_bloque == _BLOQUES_POR_RELLENO:
+            rng.standard_normal(dtype=np.float32, out=_normales_compartidas)
+            rng.random(dtype=np.float32, out=_uniformes_compartidas)
+            _siguiente_bloque = 0
+        k = _siguiente_bloque
+        _siguiente_bloque += 1
+        return _normales_compartidas[k].tolist(), _uniformes_compartidas[k].tolist()
 
 class SensorIoT:
     """Clase para simular un sensor IoT individual"""
     
-    def __init__(self, sensor_id, modelo_anomalias, interval=1.0, buffer_size=100):
+    # Atributos fijos: sin __dict__ por instancia y acceso directo en cada lectura
+    __slots__ = (
+        'sensor_id', 'modelo_anomalias', 'interval', 'buffer_size',
+        '_buf_ts', '_buf_temp', '_buf_volt', '_buf_efic', '_buf_delta', '_buf_flags',
+        '_cursor', '_ocupados', 'data_queue', 'evento_datos', 'running',
+        'total_lecturas', 'total_anomalias', 'lecturas_por_minuto', 'ultima_lectura',
+        '_contador_lecturas_minuto', '_inicio_minuto',
+        'temp_base', 'temp_std', 'volt_base', 'volt_std', 'efic_base', 'efic_std',
+        'temp_drift', 'volt_drift', 'efic_drift', 'fallo_probabilidad',
+        '_normales', '_uniformes', '_idx_aleatorio'
+    )
+    
+    def __init__(self, sensor_id, modelo_anomalias, interval=1.0, buffer_size=100, evento_datos=None):
         """
         Inicializa un sensor IoT
         
@@ -18,27 +65,39 @@ class SensorIoT:
             modelo_anomalias (ModeloAnomalias): Instancia del modelo de detección
             interval (float): Intervalo entre lecturas (segundos)
             buffer_size (int): Tamaño del buffer histórico
+            evento_datos (threading.Event): Se activa con cada lectura publicada (opcional)
         """
         self.sensor_id = sensor_id
         self.modelo_anomalias = modelo_anomalias
         self.interval = interval
         self.buffer_size = buffer_size
         
-        # Buffer para datos históricos
-        self.data_buffer = deque(maxlen=buffer_size)
+        # Ring buffer para datos históricos: un array por campo y un cursor de escritura
+        self._buf_ts = np.empty(buffer_size, dtype='datetime64[us]')
+        self._buf_temp = np.empty(buffer_size, dtype=np.float32)
+        self._buf_volt = np.empty(buffer_size, dtype=np.float32)
+        self._buf_efic = np.empty(buffer_size, dtype=np.float32)
+        self._buf_delta = np.empty(buffer_size, dtype=np.float32)  # NaN si no hay lectura anterior
+        self._buf_flags = np.empty(buffer_size, dtype=np.uint8)    # Bits de ALERTAS
+        self._cursor = 0
+        self._ocupados = 0
         
         # Cola thread-safe para comunicación
-        self.data_queue = queue.Queue()
+        # (deque: append/popleft son atómicos en CPython, sin los locks de queue.Queue;
+        # acotada para no crecer sin límite si nadie la consume, p. ej. desde la API)
+        self.data_queue = deque(maxlen=buffer_size)
+        self.evento_datos = evento_datos
         
-        # Control de threading
+        # Control de ejecución (el planificador del gestor genera las lecturas)
         self.running = False
-        self.thread = None
         
         # Estadísticas
         self.total_lecturas = 0
         self.total_anomalias = 0
         self.lecturas_por_minuto = 0
         self.ultima_lectura = None
+        self._contador_lecturas_minuto = 0
+        self._inicio_minuto = time.monotonic_ns()
         
         # Configuración del sensor (simulación)
         self._configurar_sensor()
@@ -46,32 +105,9 @@ class SensorIoT:
     def _configurar_sensor(self):
         """Configura los parámetros específicos del sensor"""
         # Parámetros base diferenciados por sensor
-        sensor_configs = {
-            "SENSOR_01": {
-                "temp_base": 70.0, "temp_std": 3.0,
-                "volt_base": 220.0, "volt_std": 5.0,
-                "efic_base": 82.0, "efic_std": 3.0
-            },
-            "SENSOR_02": {
-                "temp_base": 68.0, "temp_std": 2.5,
-                "volt_base": 218.0, "volt_std": 4.0,
-                "efic_base": 80.0, "efic_std": 2.8
-            },
-            "SENSOR_03": {
-                "temp_base": 72.0, "temp_std": 3.5,
-                "volt_base": 222.0, "volt_std": 6.0,
-                "efic_base": 84.0, "efic_std": 3.2
-            }
-        }
-        
-        config = sensor_configs.get(self.sensor_id, sensor_configs["SENSOR_01"])
-        
-        self.temp_base = config["temp_base"]
-        self.temp_std = config["temp_std"]
-        self.volt_base = config["volt_base"]
-        self.volt_std = config["volt_std"]
-        self.efic_base = config["efic_base"]
-        self.efic_std = config["efic_std"]
+        (self.temp_base, self.temp_std,
+         self.volt_base, self.volt_std,
+         self.efic_base, self.efic_std) = _SENSOR_CONFIGS.get(self.sensor_id, _SENSOR_CONFIGS["SENSOR_01"])
         
         # Factores de deriva temporal
         self.temp_drift = 0.0
@@ -80,39 +116,57 @@ class SensorIoT:
         
         # Simulación de fallos ocasionales
         self.fallo_probabilidad = 0.02  # 2% de probabilidad de fallo por lectura
+        
+        # Números aleatorios pregenerados por bloques (una llamada a NumPy cada N lecturas)
+        self._rellenar_aleatorios()
+    
+    def _rellenar_aleatorios(self):
+        """Toma un nuevo bloque de normales y uniformes para las próximas lecturas"""
+        self._normales, self._uniformes = _tomar_bloque_aleatorio()
+        self._idx_aleatorio = 0
     
     def _generar_lectura_sensor(self):
         """Genera una lectura realista del sensor"""
         timestamp = datetime.now()
         
-        # Simulación de condiciones normales vs anómalas
-        if np.random.random() < self.fallo_probabilidad:
-            # Simular condición anómala
-            if np.random.random() < 0.3:  # Fallo de voltaje
-                voltaje = np.random.normal(200, 5)
-            elif np.random.random() < 0.3:  # Sobrecalentamiento
-                temperatura = np.random.normal(85, 2)
-                voltaje = np.random.normal(self.volt_base + self.volt_drift, self.volt_std)
-            else:  # Caída de eficiencia
-                temperatura = np.random.normal(self.temp_base + self.temp_drift, self.temp_std)
-                voltaje = np.random.normal(self.volt_base + self.volt_drift, self.volt_std)
+        # Tomar los aleatorios de esta lectura del bloque pregenerado
+        i = self._idx_aleatorio
+        n0, n1, n2, n3, n4, n5 = self._normales[i]
+        u0, u1, u2 = self._uniformes[i]
+        if i + 1 == _TAM_BLOQUE:
+            self._rellenar_aleatorios()
         else:
-            # Condiciones normales
-            temperatura = np.random.normal(self.temp_base + self.temp_drift, self.temp_std)
-            voltaje = np.random.normal(self.volt_base + self.volt_drift, self.volt_std)
+            self._idx_aleatorio = i + 1
+        
+        # Estado de deriva en variables locales durante el cálculo
+        temp_drift = self.temp_drift
+        volt_drift = self.volt_drift
+        efic_drift = self.efic_drift
+        
+        # Condiciones normales
+        temperatura = self.temp_base + temp_drift + self.temp_std * n0
+        voltaje = self.volt_base + volt_drift + self.volt_std * n1
+        
+        # Simulación de condiciones anómalas
+        if u0 < self.fallo_probabilidad:
+            if u1 < 0.3:  # Fallo de voltaje
+                voltaje = 200 + 5 * n1
+            elif u2 < 0.3:  # Sobrecalentamiento
+                temperatura = 85 + 2 * n0
+            # En otro caso: caída de eficiencia con valores normales
         
         # Eficiencia siempre con su lógica normal
-        eficiencia = np.random.normal(self.efic_base + self.efic_drift, self.efic_std)
+        eficiencia = self.efic_base + efic_drift + self.efic_std * n2
         
         # Aplicar deriva temporal pequeña
-        self.temp_drift += np.random.normal(0, 0.02)
-        self.volt_drift += np.random.normal(0, 0.1)
-        self.efic_drift += np.random.normal(0, 0.05)
+        temp_drift += 0.02 * n3
+        volt_drift += 0.1 * n4
+        efic_drift += 0.05 * n5
         
-        # Limitar derivas extremas
-        self.temp_drift = np.clip(self.temp_drift, -3, 3)
-        self.volt_drift = np.clip(self.volt_drift, -8, 8)
-        self.efic_drift = np.clip(self.efic_drift, -4, 4)
+        # Limitar derivas extremas (comparaciones en línea, sin llamadas a min/max)
+        self.temp_drift = 3.0 if temp_drift > 3.0 else -3.0 if temp_drift < -3.0 else temp_drift
+        self.volt_drift = 8.0 if volt_drift > 8.0 else -8.0 if volt_drift < -8.0 else volt_drift
+        self.efic_drift = 4.0 if efic_drift > 4.0 else -4.0 if efic_drift < -4.0 else efic_drift
         
         return {
             'timestamp': timestamp,
@@ -122,75 +176,111 @@ class SensorIoT:
             'eficiencia_pct': round(eficiencia, 2)
         }
     
-    def _procesar_lectura(self, lectura):
-        """Procesa una lectura con el modelo de anomalías"""
-        # Obtener eficiencia anterior si existe
-        efic_anterior = None
-        if self.data_buffer:
-            efic_anterior = self.data_buffer[-1]['eficiencia_pct']
+    def eficiencia_anterior(self):
+        """Eficiencia de la última lectura (None si aún no hay ninguna)"""
+        return self.ultima_lectura['eficiencia_pct'] if self.ultima_lectura else None
+    
+    def _procesar_lectura(self, lectura, efic_anterior, mascara=None):
+        """Completa una lectura con su resultado de anomalía y la registra"""
+        if mascara is not None:
+            delta = (lectura['eficiencia_pct'] - efic_anterior) if efic_anterior is not None else None
+            resultado_anomalia = self.modelo_anomalias.componer_resultado(mascara, delta)
+        else:
+            # Sin máscara del lote se evalúa directamente con el modelo
+            resultado_anomalia = self.modelo_anomalias.verificar_estado_completo(
+                lectura['temperatura_c'],
+                lectura['voltaje_v'],
+                lectura['eficiencia_pct'],
+                efic_anterior,
+                requiere_modelo=False
+            )
+        
+        # Combinar datos de lectura con resultado de anomalía
+        lectura.update(resultado_anomalia)
+        self._registrar_lectura(lectura)
         
-        # Verificar anomalías usando el modelo
-        resultado_anomalia = self.modelo_anomalias.verificar_estado_completo(
+        return lectura
+    
+    def _append_row(self, ts, temp, volt, efic, delta, flags):
+        """Escribe una lectura en la posición del cursor y lo avanza"""
+        i = self._cursor
+        self._buf_ts[i] = ts
+        self._buf_temp[i] = temp
+        self._buf_volt[i] = volt
+        self._buf_efic[i] = efic
+        self._buf_delta[i] = delta
+        self._buf_flags[i] = flags
+        self._cursor = (i + 1) % self.buffer_size
+        if self._ocupados < self.buffer_size:
+            self._ocupados += 1
+    
+    def _guardar_en_buffer(self, lectura):
+        """Guarda la lectura procesada en el ring buffer"""
+        delta = lectura['delta_efic']
+        self._append_row(
+            lectura['timestamp'],
             lectura['temperatura_c'],
             lectura['voltaje_v'],
             lectura['eficiencia_pct'],
-            efic_anterior
+            np.nan if delta is None else delta,
+            lectura['alerta_mask']
         )
+    
+    def _ultimos_registros(self, cantidad):
+        """Devuelve las columnas de los últimos registros en orden cronológico, en O(cantidad)"""
+        cantidad = max(0, min(cantidad, self._ocupados))
+        inicio = (self._cursor - cantidad) % self.buffer_size
+        columnas = {
+            'ts': self._buf_ts,
+            't': self._buf_temp,
+            'v': self._buf_volt,
+            'e': self._buf_efic,
+            'delta': self._buf_delta,
+            'alert': self._buf_flags
+        }
+        if inicio + cantidad <= self.buffer_size:
+            # Tramo contiguo: vistas, sin copia
+            return {k: col[inicio:inicio + cantidad] for k, col in columnas.items()}
+        # El tramo da la vuelta: unir el final y el principio de cada columna
+        return {k: np.concatenate((col[inicio:], col[:self._cursor])) for k, col in columnas.items()}
+    
+    def _buffer_ordenado(self):
+        """Devuelve el contenido del ring buffer en orden cronológico"""
+        return self._ultimos_registros(self._ocupados)
+    
+    def _registrar_lectura(self, lectura_procesada):
+        """Guarda una lectura procesada y actualiza las estadísticas"""
+        # Almacenar en buffer
+        self._guardar_en_buffer(lectura_procesada)
         
-        # Combinar datos de lectura con resultado de anomalía
-        lectura.update(resultado_anomalia)
+        # Enviar a cola para procesamiento externo (la lectura no se modifica
+        # después de este punto, así que se comparte sin copiarla)
+        self.data_queue.append(lectura_procesada)
+        if self.evento_datos is not None:
+            self.evento_datos.set()
         
-        return lectura
-    
-    def _loop_sensor(self):
-        """Loop principal del sensor ejecutado en thread separado"""
-        print(f"🚀 [{self.sensor_id}] Iniciado - Intervalo: {self.interval}s")
+        # Actualizar estadísticas
+        self.total_lecturas += 1
+        self.ultima_lectura = lectura_procesada
+        self._contador_lecturas_minuto += 1
         
-        contador_lecturas_minuto = 0
-        inicio_minuto = time.time()
+        if lectura_procesada['alerta_total']:
+            self.total_anomalias += 1
         
-        while self.running:
-            try:
-                # Generar lectura
-                lectura = self._generar_lectura_sensor()
-                
-                # Procesar con modelo de anomalías
-                lectura_procesada = self._procesar_lectura(lectura)
-                
-                # Almacenar en buffer
-                self.data_buffer.append(lectura_procesada)
-                
-                # Enviar a cola para procesamiento externo
-                self.data_queue.put(lectura_procesada.copy())
-                
-                # Actualizar estadísticas
-                self.total_lecturas += 1
-                self.ultima_lectura = lectura_procesada
-                contador_lecturas_minuto += 1
-                
-                if lectura_procesada['alerta_total']:
-                    self.total_anomalias += 1
-                
-                # Calcular lecturas por minuto
-                if time.time() - inicio_minuto >= 60:
-                    self.lecturas_por_minuto = contador_lecturas_minuto
-                    contador_lecturas_minuto = 0
-                    inicio_minuto = time.time()
-                
-                # Pausa según intervalo configurado
-                time.sleep(self.interval)
-                
-            except Exception as e:
-                print(f"❌ [{self.sensor_id}] Error: {e}")
-                time.sleep(self.interval)
+        # Calcular lecturas por minuto (reloj monotónico en ns enteros: inmune a ajustes de NTP)
+        ahora = time.monotonic_ns()
+        if ahora - self._inicio_minuto >= 60_000_000_000:
+            self.lecturas_por_minuto = self._contador_lecturas_minuto
+            self._contador_lecturas_minuto = 0
+            self._inicio_minuto = ahora
     
     def iniciar(self):
-        """Inicia el sensor en un thread separado"""
+        """Marca el sensor como activo (el planificador del gestor genera sus lecturas)"""
         if not self.running:
             self.running = True
-            self.thread = threading.Thread(target=self._loop_sensor)
-            self.thread.daemon = True
-            self.thread.start()
+            self._contador_lecturas_minuto = 0
+            self._inicio_minuto = time.monotonic_ns()
+            print(f"🚀 [{self.sensor_id}] Iniciado - Intervalo: {self.interval}s")
             return True
         return False
     
@@ -198,8 +288,6 @@ class SensorIoT:
         """Detiene el sensor"""
         if self.running:
             self.running = False
-            if self.thread and self.thread.is_alive():
-                self.thread.join(timeout=2)
             return True
         return False
     
@@ -207,11 +295,13 @@ class SensorIoT:
         """Obtiene el estado actual del sensor"""
         tasa_anomalias = (self.total_anomalias / max(1, self.total_lecturas)) * 100
 
-        # Reemplazar claves para coincidir con el esquema
+        # Reemplazar claves para coincidir con el esquema y traducir la máscara de alertas
         lectura = None
         if self.ultima_lectura:
             lectura = self.ultima_lectura.copy()
-            lectura["fuentes_alerta"] = lectura.pop("fuente_alerta", [])
+            mascara = lectura["alerta_mask"]
+            lectura["fuentes_alerta"] = list(FUENTES_POR_MASCARA[mascara])
+            lectura["alertas_individuales"] = dict(ALERTAS_POR_MASCARA[mascara])
             lectura["delta_eficiencia"] = lectura.pop("delta_efic", None)
     
         return {
@@ -221,42 +311,53 @@ class SensorIoT:
             'total_anomalias': self.total_anomalias,
             'tasa_anomalias_pct': round(tasa_anomalias, 2),
             'lecturas_por_minuto': self.lecturas_por_minuto,
-            'buffer_size': len(self.data_buffer),
+            'buffer_size': self._ocupados,
             'ultima_lectura': lectura,
             'tiene_alerta_activa': self.ultima_lectura['alerta_total'] if self.ultima_lectura else False
         }
     
     def obtener_ultimas_lecturas(self, cantidad=10):
         """Obtiene las últimas N lecturas del buffer"""
-        if cantidad == 1:
-            return list(self.data_buffer)[-1] if self.data_buffer else None
-        return list(self.data_buffer)[-cantidad:] if len(self.data_buffer) >= cantidad else list(self.data_buffer)
+        c = self._ultimos_registros(cantidad)
+        # Los valores se guardan en float32; se redondean a los 2 decimales originales
+        return [
+            {
+                'timestamp': ts,
+                'sensor_id': self.sensor_id,
+                'temperatura_c': round(t, 2),
+                'voltaje_v': round(v, 2),
+                'eficiencia_pct': round(e, 2),
+                'alerta_total': bool(m),
+                'fuentes_alerta': list(FUENTES_POR_MASCARA[m]),
+                'delta_eficiencia': None if d != d else round(d, 2)  # NaN != NaN
+            }
+            for ts, t, v, e, d, m in zip(
+                c['ts'].tolist(), c['t'].tolist(), c['v'].tolist(),
+                c['e'].tolist(), c['delta'].tolist(), c['alert'].tolist()
+            )
+        ]
     
     def obtener_datos_historicos(self):
         """Convierte el buffer a DataFrame para análisis"""
-        if not self.data_buffer:
+        if not self._ocupados:
             return pd.DataFrame()
         
-        datos = []
-        for lectura in self.data_buffer:
-            fila = {
-                'timestamp': lectura['timestamp'],
-                'sensor_id': lectura['sensor_id'],
-                'temperatura_c': lectura['temperatura_c'],
-                'voltaje_v': lectura['voltaje_v'],
-                'eficiencia_pct': lectura['eficiencia_pct'],
-                'alerta_total': lectura['alerta_total'],
-                'fuentes_alerta': ','.join(lectura['fuentes_alerta']),
-
-                'delta_eficiencia': lectura.get('delta_efic')
-
-            }
-            
-            # Agregar alertas individuales
-            for alerta, activa in lectura['alertas_individuales'].items():
-                fila[f'alerta_{alerta}'] = activa
-            
-            datos.append(fila)
+        # Cada campo del ring buffer es ya una columna
+        registros = self._buffer_ordenado()
+        mascara = registros['alert']
+        datos = {
+            'timestamp': registros['ts'],
+            'sensor_id': self.sensor_id,
+            'temperatura_c': registros['t'],
+            'voltaje_v': registros['v'],
+            'eficiencia_pct': registros['e'],
+            'alerta_total': mascara != 0,
+            'fuentes_alerta': _TEXTO_FUENTES[mascara],
+            'delta_eficiencia': registros['delta']
+        }
         
-        return pd.DataFrame(datos)
-
+        # Agregar alertas individuales
+        for bit, alerta in enumerate(ALERTAS):
+            datos[f'alerta_{alerta}'] = (mascara >> bit & 1).astype(bool)
+        
+        return pd.DataFrame.from_dict(datos)
@@ -1,8 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Dict
 from datetime import datetime
 
 class LecturaSensorDTO(BaseModel):
+    # Pydantic v2 serializa datetime en ISO 8601 desde su núcleo en Rust
+    model_config = ConfigDict(frozen=True)
+
     timestamp: datetime
     sensor_id: str
     temperatura_c: float
@@ -11,13 +14,10 @@ class LecturaSensorDTO(BaseModel):
     alerta_total: bool
     fuentes_alerta: List[str]
     delta_eficiencia: Optional[float]
-    
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
 
 class EstadoSensorDTO(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     sensor_id: str
     activo: bool
     total_lecturas: int
@@ -28,6 +28,8 @@ class EstadoSensorDTO(BaseModel):
     ultima_lectura: Optional[LecturaSensorDTO]
 
 class SistemaDTO(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     sensores: Dict[str, EstadoSensorDTO]
     total_lecturas: int
     total_anomalias: int